@@ -1,23 +1,57 @@
-import io
-import json
+import asyncio
+import fcntl
+import hashlib
 import os
-from typing import List
+import tempfile
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Tuple
 
-# Disable GPU
-os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+
+def available_cpus() -> List[int]:
+    """Return the CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+# CPUs given to each worker process; the default of every CPU means a single
+# worker. Must be set before mushroom_core sizes its thread pools.
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", len(available_cpus())))
+if WORKER_THREADS < 1:
+    raise ValueError(f"WORKER_THREADS must be at least 1, got {WORKER_THREADS}")
+os.environ.setdefault("INTRA_OP_THREADS", str(WORKER_THREADS))
 
 import numpy as np
-from PIL import Image
 from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, RedirectResponse
-import keras
+
+from mushroom_core import (
+    IMAGE_SIZE,
+    MODEL_PATH,
+    NAMES_PATH,
+    Predictor,
+    UploadLimitMiddleware,
+    configure_threads,
+    load_class_names,
+    preprocess_image,
+    top_n,
+)
 
 # Configuration
-MODEL_PATH = "mushroom_model.keras"
-NAMES_PATH = "mushroom_names.json"
-IMAGE_SIZE = (128, 128)
+# "auto" (pick by CPU), "tflite" (FP16 weights) or "onnx" (INT8 weights)
+INFERENCE_ENGINE = os.environ.get("INFERENCE_ENGINE", "auto")
 MAX_TOP_N = 20
+# Port served by `python backend.py`; also keeps CPU-slot locks per instance
+PORT = int(os.environ.get("PORT", 8000))
+# Request bodies larger than this are rejected before they are parsed
+MAX_UPLOAD_BYTES = 8_000_000
+# Dynamic batching: largest batch per forward pass and how long to wait for it
+MAX_BATCH = 16
+BATCH_WAIT_MS = 5
+# Preallocated input rows for requests in flight; more are allocated on demand
+ROW_POOL_SIZE = 4 * MAX_BATCH
 
 app = FastAPI(
     title="Mushroom Classifier",
@@ -26,6 +60,10 @@ app = FastAPI(
     root_path="/mushrooms",
 )
 
+# Reject oversized uploads before the form is parsed; added before CORS so
+# the CORS middleware wraps it and its error responses keep CORS headers
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+
 # Add CORS middleware for Next.js frontend
 app.add_middleware(
     CORSMiddleware,
@@ -41,48 +79,175 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global variables for model and class names
-model = None
+# Global variables for class names and the batching inference front-end
 class_names = None
+batched_predictor = None
+inference_executor = None
+# Held open for the life of the worker to keep its CPU slot claimed
+worker_lock = None
+
+
+class BatchedPredictor:
+    """Group concurrent prediction requests into a single batched forward pass."""
+
+    def __init__(
+        self,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        executor: Executor,
+        input_shape: Tuple[int, ...],
+        max_batch: int = MAX_BATCH,
+        wait_ms: float = BATCH_WAIT_MS,
+        pool_size: int = ROW_POOL_SIZE,
+    ):
+        self.predict_fn = predict_fn
+        self.executor = executor
+        self.input_shape = input_shape
+        self.max_batch = max_batch
+        self.wait_s = wait_ms / 1000
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = None
+        self.batch_buffer = np.empty((max_batch, *input_shape), dtype=np.float32)
+        self.rows = np.empty((pool_size, 1, *input_shape), dtype=np.float32)
+        self.free_rows = list(range(pool_size))
+
+    def start(self) -> None:
+        """Start the background batching loop on the running event loop."""
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    @contextmanager
+    def row(self) -> Iterator[np.ndarray]:
+        """Lend a (1, *input_shape) input row for one request.
+
+        Rows come from a preallocated pool; a fresh one is allocated only
+        when every pooled row is in use. Must be used on the event loop.
+        """
+        if not self.free_rows:
+            yield np.empty((1, *self.input_shape), dtype=np.float32)
+            return
+        slot = self.free_rows.pop()
+        try:
+            yield self.rows[slot]
+        finally:
+            self.free_rows.append(slot)
+
+    async def submit(self, img: np.ndarray) -> np.ndarray:
+        """Queue a single preprocessed image and wait for its probabilities.
+
+        The image must not be modified until the returned coroutine finishes.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((img, future))
+        return await future
+
+    async def _collect(self) -> list:
+        """Wait for one request, then gather more until full or the window closes."""
+        loop = asyncio.get_running_loop()
+        items = [await self.queue.get()]
+        deadline = loop.time() + self.wait_s
+        while len(items) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            imgs = [img for img, _ in items]
+            batch = np.stack(imgs, out=self.batch_buffer[: len(imgs)])
+            try:
+                probs = await loop.run_in_executor(
+                    self.executor, self.predict_fn, batch
+                )
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), row in zip(items, probs):
+                if not future.done():
+                    future.set_result(row)
+
+
+def worker_lock_path(slot: int) -> str:
+    """Return the lock file for a CPU slot, namespaced by app directory and port.
+
+    Without the namespace a second instance on the same host (or a dev run
+    next to the service) would claim this instance's slots.
+    """
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    namespace = hashlib.sha1(f"{app_dir}:{PORT}".encode()).hexdigest()[:12]
+    return os.path.join(
+        tempfile.gettempdir(), f"mushroom-worker-{namespace}-{slot}.lock"
+    )
+
 
+def pin_worker_cpus() -> None:
+    """Pin this worker to its own WORKER_THREADS-sized slice of the CPUs.
 
-def load_class_names(names_file: str) -> List[str]:
-    """Load mushroom class names from JSON file."""
-    with open(names_file, "r") as f:
-        data = json.load(f)
-    return data["mushroom_classes"]
+    Uvicorn does not number its workers, so each one claims the first free
+    slot by taking an exclusive lock on a per-slot file. Threads started
+    afterwards (inference pools, executors) inherit the affinity.
+    """
+    global worker_lock
 
+    cpus = available_cpus()
+    slots = len(cpus) // WORKER_THREADS
+    if slots <= 1 or not hasattr(os, "sched_setaffinity"):
+        return
 
-def preprocess_image(file_bytes: bytes) -> np.ndarray:
-    """Convert uploaded image to preprocessed numpy array."""
-    try:
-        img = Image.open(io.BytesIO(file_bytes)).convert("RGB")
-        img = img.resize(IMAGE_SIZE)
-        img_array = np.array(img, dtype=np.float32)
-        img_array = np.expand_dims(img_array, axis=0)
-        return img_array
-    except Exception as e:
-        raise ValueError(f"Failed to process image: {str(e)}")
+    for slot in range(slots):
+        lock = open(worker_lock_path(slot), "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            continue
+        worker_lock = lock
+        slot_cpus = cpus[slot * WORKER_THREADS : (slot + 1) * WORKER_THREADS]
+        os.sched_setaffinity(0, slot_cpus)
+        print(f"Worker {os.getpid()} pinned to CPUs {slot_cpus}")
+        return
+
+    print(f"Worker {os.getpid()} found no free CPU slot, running unpinned")
 
 
 @app.on_event("startup")
 def startup_event():
     """Load model and class names on startup."""
-    global model, class_names
+    global class_names, batched_predictor, inference_executor
 
     if not os.path.isfile(MODEL_PATH):
         raise RuntimeError(f"Model file not found: {MODEL_PATH}")
     if not os.path.isfile(NAMES_PATH):
         raise RuntimeError(f"Names file not found: {NAMES_PATH}")
 
+    pin_worker_cpus()
+    configure_threads()
+
     print(f"Loading class names from {NAMES_PATH}...")
     class_names = load_class_names(NAMES_PATH)
     print(f"Loaded {len(class_names)} mushroom classes")
 
-    print(f"Loading model from {MODEL_PATH}...")
-    model = keras.models.load_model(MODEL_PATH)
+    predictor = Predictor(INFERENCE_ENGINE, MODEL_PATH, max_batch=MAX_BATCH)
     print("Model loaded successfully")
 
+    # Touch every fixed batch shape so no request pays for first-run setup
+    predictor.warmup()
+    print("Model warmed up")
+
+    # Inference is internally multithreaded, so one worker avoids oversubscription
+    inference_executor = ThreadPoolExecutor(max_workers=1)
+    batched_predictor = BatchedPredictor(
+        predictor.predict, inference_executor, (IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+    )
+    batched_predictor.start()
+
 
 @app.get("/")
 async def web_documentation(request: Request):
@@ -120,19 +285,18 @@ async def predict(image: UploadFile = File(...), n: int = Form(3)):
         )
 
     try:
-        # Preprocess image
-        img_array = preprocess_image(file_bytes)
+        # Preprocess off the event loop straight into a row the batcher reads
+        loop = asyncio.get_running_loop()
+        with batched_predictor.row() as row:
+            await loop.run_in_executor(None, preprocess_image, file_bytes, row)
 
-        # Run inference
-        predictions = model.predict(img_array, verbose=0)
-        probs = predictions[0]
+            # Run inference
+            probs = await batched_predictor.submit(row[0])
 
         # Get top-n predictions
-        top_n_count = min(n, len(class_names))
-        top_indices = np.argsort(probs)[-top_n_count:][::-1]
-
         results = [
-            {"name": class_names[i], "confidence": float(probs[i])} for i in top_indices
+            {"name": name, "confidence": confidence}
+            for name, confidence in top_n(probs, class_names, n)
         ]
 
         return {"top_n": results}
@@ -148,11 +312,13 @@ async def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
-        "model": "loaded" if model is not None else "not loaded",
+        "model": "loaded" if batched_predictor is not None else "not loaded",
     }
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # One worker per WORKER_THREADS-sized slice of the CPUs
+    workers = max(1, len(available_cpus()) // WORKER_THREADS)
+    uvicorn.run("backend:app", host="0.0.0.0", port=PORT, workers=workers)
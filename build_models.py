@@ -0,0 +1,21 @@
+import argparse
+
+from mushroom_core import MODEL_PATH, ModelArtifacts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prebuild the converted models the inference engines load."
+    )
+    parser.add_argument(
+        "--model",
+        default=MODEL_PATH,
+        help="Path to the .keras model file",
+    )
+    args = parser.parse_args()
+
+    ModelArtifacts(args.model).build_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,48 @@
-import io
-import json
+import asyncio
 import os
-from typing import List
 
-os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+# One forward pass per request, so keep each one's thread pool small
+os.environ.setdefault("INTRA_OP_THREADS", "4")
 
 import numpy as np
-from PIL import Image
 from fastapi import FastAPI, File, Form, UploadFile
 from fastapi.responses import JSONResponse
-import keras
 
-MODEL_PATH = "mushroom_model.keras"
-NAMES_PATH = "mushroom_names.json"
-IMAGE_SIZE = (128, 128)
-
-app = FastAPI(title="Mushroom Classifier", version="1.0")
+from mushroom_core import (
+    MODEL_PATH,
+    NAMES_PATH,
+    Predictor,
+    UploadLimitMiddleware,
+    configure_threads,
+    load_class_names,
+    preprocess_image,
+    top_n,
+)
 
+MAX_UPLOAD_BYTES = 8_000_000
 
-def load_class_names(names_file: str) -> List[str]:
-    with open(names_file, "r") as f:
-        data = json.load(f)
-    return data["mushroom_classes"]
+app = FastAPI(title="Mushroom Classifier", version="1.0")
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
 
 
-def preprocess_image(file_bytes: bytes) -> np.ndarray:
-    img = Image.open(io.BytesIO(file_bytes)).convert("RGB")
-    img = img.resize(IMAGE_SIZE)
-    img_array = np.array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array
+def predict_bytes(file_bytes: bytes) -> np.ndarray:
+    return predictor.predict(preprocess_image(file_bytes))[0]
 
 
 @app.on_event("startup")
 def startup_event():
-    global model, class_names
+    global predictor, class_names
 
     if not os.path.isfile(MODEL_PATH):
         raise RuntimeError(f"Model file not found: {MODEL_PATH}")
     if not os.path.isfile(NAMES_PATH):
         raise RuntimeError(f"Names file not found: {NAMES_PATH}")
 
+    configure_threads()
+
     class_names = load_class_names(NAMES_PATH)
-    model = keras.models.load_model(MODEL_PATH)
+    predictor = Predictor("keras", MODEL_PATH)
+    predictor.warmup()
 
 
 @app.post("/predict")
@@ -54,15 +54,12 @@ async def predict(image: UploadFile = File(...), n: int = Form(3)):
     if not file_bytes:
         return JSONResponse(status_code=400, content={"error": "empty file"})
 
-    img_array = preprocess_image(file_bytes)
-    predictions = model.predict(img_array)
-    probs = predictions[0]
-
-    top_n = min(n, len(class_names))
-    top_indices = np.argsort(probs)[-top_n:][::-1]
+    loop = asyncio.get_running_loop()
+    probs = await loop.run_in_executor(None, predict_bytes, file_bytes)
 
     results = [
-        {"name": class_names[i], "confidence": float(probs[i])} for i in top_indices
+        {"name": name, "confidence": confidence}
+        for name, confidence in top_n(probs, class_names, n)
     ]
 
     return {"top_n": results}
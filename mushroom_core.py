@@ -0,0 +1,569 @@
+"""Shared preprocessing, class-name loading and inference for all entry points."""
+
+import contextlib
+import fcntl
+import io
+import json
+import os
+import shutil
+import threading
+from typing import TYPE_CHECKING, Callable, Iterable, List, Optional, Tuple, Union
+
+# Disable GPU
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+
+# Thread pools are pinned before TensorFlow is imported; callers that run one
+# forward pass per request can lower INTRA_OP_THREADS before importing us
+INTRA_OP_THREADS = int(os.environ.get("INTRA_OP_THREADS", os.cpu_count() or 1))
+os.environ.setdefault("TF_ENABLE_ONEDNN_OPTS", "1")
+os.environ.setdefault("OMP_NUM_THREADS", str(INTRA_OP_THREADS))
+os.environ.setdefault("TF_NUM_INTRAOP_THREADS", str(INTRA_OP_THREADS))
+os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+
+import cv2
+import numpy as np
+from PIL import Image
+import tensorflow as tf
+
+# Engine-specific and build-only packages (keras, onnxruntime, py-cpuinfo) are
+# imported where they are used so the keras-engine CLI does not pay for them
+if TYPE_CHECKING:
+    import onnxruntime as ort
+
+try:
+    from turbojpeg import TJPF_RGB, TurboJPEG
+
+    turbo_jpeg = TurboJPEG()
+except (ImportError, RuntimeError, OSError):  # libjpeg-turbo not installed
+    turbo_jpeg = None
+
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:  # the full TensorFlow wheel ships the same interpreter
+    Interpreter = tf.lite.Interpreter
+
+# Configuration
+MODEL_PATH = "mushroom_model.keras"
+NAMES_PATH = "mushroom_names.json"
+IMAGE_SIZE = (128, 128)
+JPEG_MAGIC = b"\xff\xd8"
+# OpenCV decode flags for each JPEG DCT-domain downscale factor
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+# Largest per-class probability drift tolerated before falling back to FP32
+INT8_MAX_ABS_DIFF = 0.05
+# Real mushroom photos the INT8 model is checked against FP32 on
+ACCURACY_CHECK_IMAGES = ("test.png",)
+ENGINES = ("tflite", "onnx", "keras")
+# CPU flags (as reported by py-cpuinfo) that enable fast INT8 GEMM kernels
+VNNI_FLAGS = {"avx512_vnni", "avx512vnni"}
+
+# Per-thread model input buffers reused across preprocess_image calls
+_buffers = threading.local()
+
+
+def load_class_names(path: str) -> List[str]:
+    """Load class names from a JSON file or from a dataset's class folders."""
+    if os.path.isdir(path):
+        return sorted(
+            d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d))
+        )
+    with open(path, "r") as f:
+        data = json.load(f)
+    return data["mushroom_classes"]
+
+
+def _input_buffer() -> np.ndarray:
+    """Return this thread's reusable (1, H, W, 3) float32 input buffer."""
+    buf = getattr(_buffers, "array", None)
+    if buf is None:
+        buf = np.empty((1, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.float32)
+        _buffers.array = buf
+    return buf
+
+
+def _reduced_decode_factor(width: int, height: int) -> int:
+    """Return the largest JPEG decode downscale (2, 4 or 8) that covers IMAGE_SIZE."""
+    for factor in (8, 4, 2):
+        if width // factor >= IMAGE_SIZE[0] and height // factor >= IMAGE_SIZE[1]:
+            return factor
+    return 1
+
+
+def preprocess_image_cv2(file_bytes: bytes, out: np.ndarray) -> np.ndarray:
+    """Decode, resize and convert an image with OpenCV's vectorized kernels.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale in the DCT domain when the
+    result still covers IMAGE_SIZE, which caps decode cost on large uploads.
+    """
+    flags = cv2.IMREAD_COLOR
+    if file_bytes[:2] == JPEG_MAGIC:
+        with Image.open(io.BytesIO(file_bytes)) as header:
+            flags = REDUCED_DECODE_FLAGS[_reduced_decode_factor(*header.size)]
+    buf = np.frombuffer(file_bytes, dtype=np.uint8)
+    img = cv2.imdecode(buf, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        raise ValueError("unsupported or corrupt image data")
+    img = cv2.resize(img, IMAGE_SIZE, interpolation=cv2.INTER_AREA)
+    cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+    out[0] = img
+    return out
+
+
+def _jpeg_scaling_factor(
+    width: int, height: int, factors: Iterable[Tuple[int, int]]
+) -> Tuple[int, int]:
+    """Return the smallest of the decoder's scales that still covers IMAGE_SIZE."""
+    for num, denom in sorted(factors, key=lambda f: f[0] / f[1]):
+        if (
+            width * num // denom >= IMAGE_SIZE[0]
+            and height * num // denom >= IMAGE_SIZE[1]
+        ):
+            return num, denom
+    return 1, 1
+
+
+def preprocess_jpeg_turbo(file_bytes: bytes, out: np.ndarray) -> np.ndarray:
+    """Decode a JPEG with libjpeg-turbo, downscaling inside the decoder."""
+    width, height, _, _ = turbo_jpeg.decode_header(file_bytes)
+    img = turbo_jpeg.decode(
+        file_bytes,
+        pixel_format=TJPF_RGB,
+        scaling_factor=_jpeg_scaling_factor(
+            width, height, turbo_jpeg.scaling_factors
+        ),
+    )
+    out[0] = cv2.resize(img, IMAGE_SIZE, interpolation=cv2.INTER_AREA)
+    return out
+
+
+def preprocess_image(
+    source: Union[bytes, str], out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Convert image bytes or an image path to a (1, H, W, 3) float32 array.
+
+    The result is written into out when given. Otherwise it goes to a
+    per-thread buffer that the next call on the same thread overwrites.
+    """
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                source = f.read()
+        if out is None:
+            out = _input_buffer()
+        if turbo_jpeg is not None and source[:2] == JPEG_MAGIC:
+            try:
+                return preprocess_jpeg_turbo(source, out)
+            except OSError:  # e.g. CMYK JPEGs; let OpenCV decode them
+                pass
+        return preprocess_image_cv2(source, out)
+    except Exception as e:
+        raise ValueError(f"Failed to process image: {str(e)}")
+
+
+def top_n(
+    probs: np.ndarray, class_names: List[str], n: int
+) -> List[Tuple[str, float]]:
+    """Return the n most likely (name, confidence) pairs, best first."""
+    n = min(n, len(probs))
+    idx = np.argpartition(probs, -n)[-n:]
+    top_indices = idx[np.argsort(probs[idx])[::-1]]
+    return list(zip([class_names[i] for i in top_indices], probs[top_indices].tolist()))
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware rejecting request bodies over max_bytes before parsing.
+
+    The multipart form is read and spooled in full before a route handler
+    runs, so the limit is enforced on Content-Length here instead. Bodies
+    without one (chunked uploads) are refused since their size is unknown.
+    """
+
+    BODY_METHODS = {"POST", "PUT", "PATCH"}
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] in self.BODY_METHODS:
+            length = dict(scope["headers"]).get(b"content-length")
+            if length is None or not length.isdigit():
+                return await self._reject(send, 411, "Content-Length is required")
+            if int(length) > self.max_bytes:
+                return await self._reject(
+                    send, 413, f"Upload must be at most {self.max_bytes} bytes"
+                )
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject(send, status: int, detail: str) -> None:
+        body = json.dumps({"detail": detail}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"connection", b"close"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+def configure_threads() -> None:
+    """Apply the pinned thread counts to TensorFlow's runtime."""
+    tf.config.threading.set_intra_op_parallelism_threads(INTRA_OP_THREADS)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+@contextlib.contextmanager
+def atomic_output(path: str):
+    """Yield a temporary path next to `path`, moved into place only on success.
+
+    Readers never see a partial file or directory at `path`, even if the
+    build raises or the process dies halfway through.
+    """
+    tmp = f"{path}.tmp-{os.getpid()}"
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+        elif os.path.exists(tmp):
+            os.remove(tmp)
+
+
+@contextlib.contextmanager
+def build_lock(path: str):
+    """Hold an exclusive lock for building `path`, shared across processes.
+
+    Workers starting together would otherwise all run the same conversion;
+    callers re-check for the artifact once the lock is held.
+    """
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def has_vnni() -> bool:
+    """Return whether this CPU supports AVX-512 VNNI instructions."""
+    import cpuinfo
+
+    flags = cpuinfo.get_cpu_info().get("flags", [])
+    return not VNNI_FLAGS.isdisjoint(flags)
+
+
+def select_engine(onnx_path: str) -> str:
+    """Pick INT8 ONNX on VNNI-capable CPUs and FP16 TFLite everywhere else.
+
+    Without VNNI, INT8 kernels are often slower than FP32, so the
+    quantized model is only worth using when the hardware supports it.
+    TFLite is also used when the offline-converted ONNX model is not shipped.
+    """
+    if not os.path.isfile(onnx_path):
+        print(f"{onnx_path} not found, using FP16 TFLite model")
+        return "tflite"
+    if has_vnni():
+        print("AVX-512 VNNI detected, using INT8 ONNX model")
+        return "onnx"
+    print("AVX-512 VNNI not available, using FP16 TFLite model")
+    return "tflite"
+
+
+def create_session(path: str) -> "ort.InferenceSession":
+    """Create an ONNX Runtime CPU session with full graph optimizations."""
+    import onnxruntime as ort
+
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    so.intra_op_num_threads = INTRA_OP_THREADS
+    so.inter_op_num_threads = 1
+    return ort.InferenceSession(
+        path, sess_options=so, providers=["CPUExecutionProvider"]
+    )
+
+
+def run_session(sess: "ort.InferenceSession", batch: np.ndarray) -> np.ndarray:
+    """Run a batch of preprocessed images through an ONNX session."""
+    in_name = sess.get_inputs()[0].name
+    out_name = sess.get_outputs()[0].name
+    return sess.run([out_name], {in_name: batch})[0]
+
+
+def accuracy_check_batch(paths=ACCURACY_CHECK_IMAGES) -> np.ndarray:
+    """Load the accuracy-check photos plus flipped and rotated copies of each."""
+    samples = []
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        img = preprocess_image(path)[0].copy()
+        samples += [img, img[:, ::-1], img[::-1], np.rot90(img)]
+    if not samples:
+        raise FileNotFoundError(f"No accuracy-check images found: {paths}")
+    return np.ascontiguousarray(np.stack(samples))
+
+
+def int8_matches_fp32(
+    int8_session: "ort.InferenceSession", fp32_session: "ort.InferenceSession"
+) -> bool:
+    """Check that INT8 quantization kept predictions on real photos intact.
+
+    Requires the same top-1 class on every sample and a per-class
+    probability drift of at most INT8_MAX_ABS_DIFF.
+    """
+    try:
+        probe = accuracy_check_batch()
+    except FileNotFoundError as e:
+        print(f"Cannot verify INT8 accuracy: {e}")
+        return False
+    int8_probs = run_session(int8_session, probe)
+    fp32_probs = run_session(fp32_session, probe)
+    same_top1 = np.array_equal(int8_probs.argmax(axis=1), fp32_probs.argmax(axis=1))
+    drift = float(np.abs(int8_probs - fp32_probs).max())
+    return same_top1 and drift <= INT8_MAX_ABS_DIFF
+
+
+def batch_buckets(max_batch: int) -> List[int]:
+    """Return the fixed batch sizes for max_batch: powers of two, then max_batch."""
+    sizes = []
+    size = 1
+    while size < max_batch:
+        sizes.append(size)
+        size *= 2
+    sizes.append(max_batch)
+    return sizes
+
+
+def run_interpreter(interpreter: Interpreter, batch: np.ndarray) -> np.ndarray:
+    """Run a batch through a TFLite interpreter allocated for exactly its shape."""
+    interpreter.set_tensor(interpreter.get_input_details()[0]["index"], batch)
+    interpreter.invoke()
+    return interpreter.get_tensor(interpreter.get_output_details()[0]["index"])
+
+
+class ModelArtifacts:
+    """Derived model files built from the Keras model and cached next to it.
+
+    Each build is serialized across processes with build_lock and published
+    with atomic_output, so concurrent workers never convert twice or read a
+    partial file. build_all() prebuilds everything, e.g. in a Docker image.
+    """
+
+    def __init__(self, model_path: str = MODEL_PATH):
+        if not os.path.isfile(model_path):
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+
+        self.model_path = model_path
+        base = os.path.splitext(model_path)[0]
+        self.onnx_fp32_path = f"{base}.onnx"
+        self.onnx_int8_path = f"{base}_int8.onnx"
+        self.tflite_fp16_path = f"{base}_fp16.tflite"
+        self.savedmodel_path = f"{base}_savedmodel"
+
+    def build_all(self) -> None:
+        """Build every artifact; INT8 ONNX only if the FP32 .onnx is shipped."""
+        self._build_savedmodel()
+        self._build_tflite()
+        if os.path.isfile(self.onnx_fp32_path):
+            self._build_onnx()
+        else:
+            print(f"Skipping ONNX quantization: {self.onnx_fp32_path} not found")
+
+    def _build_savedmodel(self) -> None:
+        """Export the Keras model as a SavedModel with a serving signature."""
+        if os.path.isdir(self.savedmodel_path):
+            return
+
+        with build_lock(self.savedmodel_path):
+            if os.path.isdir(self.savedmodel_path):
+                return
+            print(f"Exporting {self.model_path} to {self.savedmodel_path}...")
+            import keras
+
+            keras_model = keras.models.load_model(self.model_path)
+            with atomic_output(self.savedmodel_path) as tmp:
+                keras_model.export(tmp)
+
+    def _build_onnx(self) -> None:
+        """Quantize the shipped FP32 ONNX model to INT8, cached on disk.
+
+        The FP32 model is converted offline (see BACKEND_README.md) because
+        tf2onnx cannot be installed alongside this TensorFlow release.
+        """
+        if not os.path.isfile(self.onnx_fp32_path):
+            raise FileNotFoundError(
+                f"ONNX model not found: {self.onnx_fp32_path} "
+                "(convert it offline with tf2onnx from the exported SavedModel)"
+            )
+
+        if os.path.isfile(self.onnx_int8_path):
+            return
+
+        with build_lock(self.onnx_int8_path):
+            if os.path.isfile(self.onnx_int8_path):
+                return
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            print(f"Quantizing {self.onnx_fp32_path} to {self.onnx_int8_path}...")
+            # Only the dense layers: the CPU provider has no ConvInteger kernel
+            # for the int8 convolutions a full dynamic quantization produces
+            with atomic_output(self.onnx_int8_path) as tmp:
+                quantize_dynamic(
+                    self.onnx_fp32_path,
+                    tmp,
+                    weight_type=QuantType.QInt8,
+                    op_types_to_quantize=["MatMul", "Gemm"],
+                )
+
+    def _build_tflite(self) -> None:
+        """Convert the Keras model to an FP16-weight TFLite file, cached on disk."""
+        if os.path.isfile(self.tflite_fp16_path):
+            return
+
+        with build_lock(self.tflite_fp16_path):
+            if os.path.isfile(self.tflite_fp16_path):
+                return
+            print(f"Converting {self.model_path} to {self.tflite_fp16_path}...")
+            import keras
+
+            keras_model = keras.models.load_model(self.model_path)
+            converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+            tflite_model = converter.convert()
+            with atomic_output(self.tflite_fp16_path) as tmp:
+                with open(tmp, "wb") as f:
+                    f.write(tflite_model)
+
+
+class Predictor(ModelArtifacts):
+    """Own a loaded model and run batches of preprocessed images through it.
+
+    Engines:
+    - tflite: FP16-weight TFLite model
+    - onnx: INT8 ONNX Runtime model, or FP32 if quantization hurts accuracy;
+      the FP32 .onnx file is converted offline and shipped with the model
+    - keras: the Keras model exported as a SavedModel serving signature
+
+    "auto" picks onnx or tflite based on the CPU (see select_engine) and
+    falls back to tflite if the ONNX model fails to load.
+    max_batch is the largest batch callers send; the tflite engine keeps one
+    interpreter per batch_buckets size and pads each batch up to the nearest.
+    Converted models are built on first use unless prebuilt (see ModelArtifacts).
+    """
+
+    def __init__(
+        self, engine: str = "auto", model_path: str = MODEL_PATH, max_batch: int = 1
+    ):
+        super().__init__(model_path)
+        auto = engine == "auto"
+        if auto:
+            engine = select_engine(self.onnx_fp32_path)
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown inference engine: {engine}")
+
+        self.engine = engine
+        self.max_batch = max_batch
+
+        loaders = {
+            "tflite": self._load_tflite,
+            "onnx": self._load_onnx,
+            "keras": self._load_keras,
+        }
+        try:
+            self._predict = loaders[engine]()
+        except Exception as e:
+            # Only an explicitly requested engine is fatal; auto keeps serving
+            if not auto or engine == "tflite":
+                raise
+            print(f"{engine} engine failed to load ({e}), using FP16 TFLite model")
+            self.engine = "tflite"
+            self._predict = self._load_tflite()
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """Return class probabilities for a (N, H, W, 3) float32 batch."""
+        return self._predict(batch)
+
+    def warmup(self) -> None:
+        """Run a dummy batch of every bucket size before real requests arrive."""
+        for size in batch_buckets(self.max_batch):
+            self.predict(np.zeros((size, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), np.float32))
+
+    def _load_keras(self) -> Callable[[np.ndarray], np.ndarray]:
+        self._build_savedmodel()
+
+        print(f"Loading model from {self.savedmodel_path}...")
+        self.saved_model = tf.saved_model.load(self.savedmodel_path)
+        infer = self.saved_model.signatures["serving_default"]
+        # Compile the serving graph with XLA, as the in-process Keras path did
+        xla_infer = tf.function(
+            lambda batch: infer(batch)["output_0"], jit_compile=True
+        )
+        return lambda batch: xla_infer(tf.constant(batch)).numpy()
+
+    def _load_onnx(self) -> Callable[[np.ndarray], np.ndarray]:
+        self._build_onnx()
+
+        print(f"Loading model from {self.onnx_int8_path}...")
+        fp32_session = create_session(self.onnx_fp32_path)
+        try:
+            session = create_session(self.onnx_int8_path)
+        except Exception as e:
+            print(f"INT8 model failed to load ({e}), falling back to FP32 model")
+            session = fp32_session
+        else:
+            if int8_matches_fp32(session, fp32_session):
+                del fp32_session
+            else:
+                print("INT8 accuracy check failed, falling back to FP32 model")
+                session = fp32_session
+
+        input_name = session.get_inputs()[0].name
+        output_name = session.get_outputs()[0].name
+        return lambda batch: session.run([output_name], {input_name: batch})[0]
+
+    def _load_tflite(self) -> Callable[[np.ndarray], np.ndarray]:
+        self._build_tflite()
+
+        print(f"Loading model from {self.tflite_fp16_path}...")
+        # Tensors are allocated once per fixed batch size; resizing on every
+        # differently sized batch would re-prepare the whole graph each time
+        self.tflite_buckets = batch_buckets(self.max_batch)
+        self.interpreters = {}
+        self.padded_inputs = {}
+        for size in self.tflite_buckets:
+            interpreter = Interpreter(
+                model_path=self.tflite_fp16_path, num_threads=INTRA_OP_THREADS
+            )
+            shape = (size, IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+            interpreter.resize_tensor_input(
+                interpreter.get_input_details()[0]["index"], shape
+            )
+            interpreter.allocate_tensors()
+            self.interpreters[size] = interpreter
+            self.padded_inputs[size] = np.zeros(shape, dtype=np.float32)
+        return self._predict_tflite
+
+    def _predict_tflite(self, batch: np.ndarray) -> np.ndarray:
+        """Run a batch through the smallest fitting interpreter, padding as needed."""
+        outputs = []
+        for start in range(0, len(batch), self.max_batch):
+            chunk = batch[start : start + self.max_batch]
+            n = len(chunk)
+            size = next(s for s in self.tflite_buckets if s >= n)
+            if size != n:
+                self.padded_inputs[size][:n] = chunk
+                chunk = self.padded_inputs[size]
+            outputs.append(run_interpreter(self.interpreters[size], chunk)[:n])
+        return outputs[0] if len(outputs) == 1 else np.concatenate(outputs)
@@ -1,38 +1,9 @@
 import argparse
 import os
-from typing import List, Tuple
 
 import numpy as np
-from PIL import Image
-import keras
-import matplotlib.pyplot as plt
 
-
-def load_class_names(data_dir: str) -> List[str]:
-    return sorted(
-        [
-            d
-            for d in os.listdir(data_dir)
-            if os.path.isdir(os.path.join(data_dir, d))
-        ]
-    )
-
-
-def preprocess_image(image_path: str, size: Tuple[int, int] = (128, 128)) -> np.ndarray:
-    img = Image.open(image_path).convert("RGB")
-    img = img.resize(size)
-    print("Your image is: ")
-    plt.imshow(img)
-    plt.show()
-    img_array = np.array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array
-
-
-def get_top_k(predictions: np.ndarray, class_names: List[str], k: int = 3):
-    probs = predictions[0]
-    top_indices = np.argsort(probs)[-k:][::-1]
-    return [(class_names[i], float(probs[i])) for i in top_indices]
+from mushroom_core import Predictor, load_class_names, preprocess_image, top_n
 
 
 def main():
@@ -54,6 +25,11 @@ def main():
         default=3,
         help="Number of top predictions to show",
     )
+    parser.add_argument(
+        "--show",
+        action="store_true",
+        help="Display the preprocessed image before predicting",
+    )
     args = parser.parse_args()
 
     if not os.path.isfile(args.model):
@@ -64,11 +40,17 @@ def main():
         raise FileNotFoundError(f"Image not found: {args.image}")
 
     class_names = load_class_names(args.data_dir)
-    Model = keras.models.load_model(args.model)
+    predictor = Predictor("keras", args.model)
 
     img_array = preprocess_image(args.image)
-    predictions = Model.predict(img_array)
-    top_k = get_top_k(predictions, class_names, k=args.top_k)
+    if args.show:
+        import matplotlib.pyplot as plt
+
+        print("Your image is: ")
+        plt.imshow(img_array[0].astype(np.uint8))
+        plt.show()
+    predictions = predictor.predict(img_array)
+    top_k = top_n(predictions[0], class_names, args.top_k)
 
     print("Top predictions:")
     for name, prob in top_k:
@@ -0,0 +1,102 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from backend import BatchedPredictor
+
+INPUT_SHAPE = (2,)
+
+
+def make_predictor(predict_fn, **kwargs):
+    return BatchedPredictor(
+        predict_fn, ThreadPoolExecutor(max_workers=1), INPUT_SHAPE, **kwargs
+    )
+
+
+async def submit_all(predictor, values):
+    predictor.start()
+    try:
+        return await asyncio.gather(
+            *(
+                predictor.submit(np.full(INPUT_SHAPE, v, dtype=np.float32))
+                for v in values
+            ),
+            return_exceptions=True,
+        )
+    finally:
+        predictor.task.cancel()
+
+
+def test_concurrent_requests_share_one_batch():
+    sizes = []
+
+    def predict_fn(batch):
+        sizes.append(len(batch))
+        return batch * 10
+
+    predictor = make_predictor(predict_fn, max_batch=4, wait_ms=50)
+    results = asyncio.run(submit_all(predictor, [1, 2, 3]))
+
+    assert sizes == [3]
+    assert [r.tolist() for r in results] == [[10, 10], [20, 20], [30, 30]]
+
+
+def test_batches_are_capped_at_max_batch():
+    sizes = []
+
+    def predict_fn(batch):
+        sizes.append(len(batch))
+        return batch.copy()
+
+    predictor = make_predictor(predict_fn, max_batch=2, wait_ms=50)
+    results = asyncio.run(submit_all(predictor, [1, 2, 3, 4, 5]))
+
+    assert sizes == [2, 2, 1]
+    assert [r[0] for r in results] == [1, 2, 3, 4, 5]
+
+
+def test_errors_fail_every_request_in_the_batch():
+    calls = []
+
+    def predict_fn(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return batch.copy()
+
+    async def scenario(predictor):
+        failed = await submit_all(predictor, [1, 2])
+        # The loop must survive the failure and serve later requests
+        recovered = await submit_all(predictor, [3])
+        return failed, recovered
+
+    predictor = make_predictor(predict_fn, max_batch=4, wait_ms=50)
+    failed, recovered = asyncio.run(scenario(predictor))
+
+    assert calls[0] == 2
+    assert all(isinstance(r, RuntimeError) for r in failed)
+    assert recovered[0].tolist() == [3, 3]
+
+
+def test_rows_come_from_the_pool_until_it_runs_out():
+    predictor = make_predictor(lambda batch: batch, pool_size=1)
+
+    with predictor.row() as pooled:
+        with predictor.row() as extra:
+            assert pooled.shape == extra.shape == (1, *INPUT_SHAPE)
+            assert np.shares_memory(pooled, predictor.rows)
+            assert not np.shares_memory(extra, predictor.rows)
+        assert predictor.free_rows == []
+    assert predictor.free_rows == [0]
+
+
+@pytest.mark.parametrize("pool_size", [0, 2])
+def test_rows_are_returned_after_errors(pool_size):
+    predictor = make_predictor(lambda batch: batch, pool_size=pool_size)
+
+    with pytest.raises(ValueError):
+        with predictor.row():
+            raise ValueError
+    assert sorted(predictor.free_rows) == list(range(pool_size))
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import mushroom_core
+from mushroom_core import Predictor
+
+
+class FakeSession:
+    def __init__(self, path, value):
+        self.path = path
+        self.value = value
+
+    def get_inputs(self):
+        return [type("Arg", (), {"name": "input"})]
+
+    def get_outputs(self):
+        return [type("Arg", (), {"name": "output"})]
+
+    def run(self, output_names, feeds):
+        return [np.full((len(feeds["input"]), 2), self.value, dtype=np.float32)]
+
+
+@pytest.fixture
+def model_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(Predictor, "_build_onnx", lambda self: None)
+    path = tmp_path / "model.keras"
+    path.write_bytes(b"")
+    return str(path)
+
+
+def fake_sessions(monkeypatch, int8_error=None):
+    def create_session(path):
+        if path.endswith("_int8.onnx"):
+            if int8_error is not None:
+                raise int8_error
+            return FakeSession(path, 8)
+        return FakeSession(path, 32)
+
+    monkeypatch.setattr(mushroom_core, "create_session", create_session)
+
+
+def predict_value(predictor):
+    return predictor.predict(np.zeros((1, 4), dtype=np.float32))[0, 0]
+
+
+def test_int8_session_is_used_when_it_loads_and_matches(model_path, monkeypatch):
+    fake_sessions(monkeypatch)
+    monkeypatch.setattr(mushroom_core, "int8_matches_fp32", lambda *_: True)
+
+    assert predict_value(Predictor("onnx", model_path)) == 8
+
+
+def test_int8_load_failure_falls_back_to_fp32(model_path, monkeypatch):
+    fake_sessions(monkeypatch, RuntimeError("NOT_IMPLEMENTED: ConvInteger(10)"))
+
+    assert predict_value(Predictor("onnx", model_path)) == 32
+
+
+def test_int8_accuracy_failure_falls_back_to_fp32(model_path, monkeypatch):
+    fake_sessions(monkeypatch)
+    monkeypatch.setattr(mushroom_core, "int8_matches_fp32", lambda *_: False)
+
+    assert predict_value(Predictor("onnx", model_path)) == 32
+
+
+def test_auto_falls_back_to_tflite_when_onnx_fails(model_path, monkeypatch):
+    monkeypatch.setattr(mushroom_core, "select_engine", lambda path: "onnx")
+    monkeypatch.setattr(
+        mushroom_core, "create_session", lambda path: 1 / 0  # any load error
+    )
+    monkeypatch.setattr(Predictor, "_load_tflite", lambda self: lambda batch: batch)
+
+    predictor = Predictor("auto", model_path)
+
+    assert predictor.engine == "tflite"
+
+
+def test_explicit_onnx_load_failure_is_fatal(model_path, monkeypatch):
+    monkeypatch.setattr(
+        mushroom_core, "create_session", lambda path: 1 / 0  # any load error
+    )
+
+    with pytest.raises(ZeroDivisionError):
+        Predictor("onnx", model_path)
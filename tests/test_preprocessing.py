@@ -0,0 +1,60 @@
+import cv2
+import numpy as np
+import pytest
+
+from mushroom_core import (
+    IMAGE_SIZE,
+    _jpeg_scaling_factor,
+    _reduced_decode_factor,
+    preprocess_image,
+    preprocess_image_cv2,
+)
+
+# A subset of libjpeg-turbo's scaling factors, deliberately unsorted
+TURBO_FACTORS = [(1, 1), (3, 4), (1, 2), (3, 8), (1, 4), (1, 8)]
+RGB = (200, 30, 60)
+
+
+def solid_jpeg(width, height):
+    bgr = np.empty((height, width, 3), dtype=np.uint8)
+    bgr[:] = RGB[::-1]
+    ok, encoded = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    assert ok
+    return encoded.tobytes()
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [
+        ((4000, 3000), (1, 8)),
+        ((1024, 1024), (1, 8)),
+        ((600, 400), (3, 8)),
+        ((300, 1000), (1, 2)),
+        ((100, 100), (1, 1)),
+    ],
+)
+def test_jpeg_scaling_factor_picks_smallest_covering_scale(size, expected):
+    assert _jpeg_scaling_factor(*size, TURBO_FACTORS) == expected
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [((4000, 3000), 8), ((1024, 1024), 8), ((600, 400), 2), ((200, 2000), 1)],
+)
+def test_reduced_decode_factor(size, expected):
+    assert _reduced_decode_factor(*size) == expected
+
+
+@pytest.mark.parametrize("preprocess", [preprocess_image, preprocess_image_cv2])
+def test_large_jpeg_is_resized_into_the_given_buffer(preprocess):
+    out = np.zeros((1, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.float32)
+
+    result = preprocess(solid_jpeg(1600, 1200), out)
+
+    assert result is out
+    assert np.allclose(out, RGB, atol=4)
+
+
+def test_corrupt_image_raises_value_error():
+    with pytest.raises(ValueError, match="Failed to process image"):
+        preprocess_image(b"\xff\xd8 not really a jpeg")
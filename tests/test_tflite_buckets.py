@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+
+import mushroom_core
+from mushroom_core import IMAGE_SIZE, Predictor, batch_buckets
+
+ROW_SHAPE = (IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+
+
+class EchoInterpreter:
+    """Stands in for the TFLite interpreter; outputs each input row's first pixel."""
+
+    invocations = []
+
+    def __init__(self, model_path, num_threads):
+        self.shape = None
+        self.allocations = 0
+
+    def get_input_details(self):
+        return [{"index": 0, "shape": np.array(self.shape or (1, *ROW_SHAPE))}]
+
+    def get_output_details(self):
+        return [{"index": 1}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shape = tuple(shape)
+
+    def allocate_tensors(self):
+        self.allocations += 1
+
+    def set_tensor(self, index, value):
+        assert value.shape == self.shape, "input must match the allocated shape"
+        self.input = value.copy()
+
+    def invoke(self):
+        EchoInterpreter.invocations.append(self.shape[0])
+
+    def get_tensor(self, index):
+        return self.input[:, 0, 0, :].copy()
+
+
+@pytest.fixture
+def make_predictor(tmp_path, monkeypatch):
+    monkeypatch.setattr(mushroom_core, "Interpreter", EchoInterpreter)
+    monkeypatch.setattr(Predictor, "_build_tflite", lambda self: None)
+    EchoInterpreter.invocations = []
+    model_path = tmp_path / "model.keras"
+    model_path.write_bytes(b"")
+
+    def make(max_batch):
+        return Predictor("tflite", str(model_path), max_batch=max_batch)
+
+    return make
+
+
+def numbered_batch(n):
+    batch = np.zeros((n, *ROW_SHAPE), dtype=np.float32)
+    batch[:] = np.arange(1, n + 1, dtype=np.float32)[:, None, None, None]
+    return batch
+
+
+def assert_rows_echoed(result, n):
+    assert result.shape == (n, 3)
+    assert result[:, 0].tolist() == list(range(1, n + 1))
+
+
+@pytest.mark.parametrize(
+    "max_batch, expected",
+    [(1, [1]), (2, [1, 2]), (16, [1, 2, 4, 8, 16]), (12, [1, 2, 4, 8, 12])],
+)
+def test_batch_buckets(max_batch, expected):
+    assert batch_buckets(max_batch) == expected
+
+
+def test_each_bucket_is_allocated_once(make_predictor):
+    predictor = make_predictor(16)
+
+    for size, interpreter in predictor.interpreters.items():
+        assert interpreter.shape == (size, *ROW_SHAPE)
+        assert interpreter.allocations == 1
+
+
+@pytest.mark.parametrize("n, bucket", [(1, 1), (4, 4), (8, 8), (16, 16)])
+def test_batch_matching_a_bucket_runs_unpadded(make_predictor, n, bucket):
+    result = make_predictor(16).predict(numbered_batch(n))
+
+    assert_rows_echoed(result, n)
+    assert EchoInterpreter.invocations == [bucket]
+
+
+@pytest.mark.parametrize("n, bucket", [(3, 4), (5, 8), (9, 16)])
+def test_smaller_batch_is_padded_to_next_bucket(make_predictor, n, bucket):
+    predictor = make_predictor(16)
+    # Leave stale rows in the pad buffer; they must not leak into the result
+    predictor.predict(numbered_batch(bucket) * 100)
+    EchoInterpreter.invocations = []
+
+    result = predictor.predict(numbered_batch(n))
+
+    assert_rows_echoed(result, n)
+    assert EchoInterpreter.invocations == [bucket]
+
+
+def test_batch_above_max_batch_is_split_and_concatenated(make_predictor):
+    result = make_predictor(16).predict(numbered_batch(21))
+
+    assert_rows_echoed(result, 21)
+    assert EchoInterpreter.invocations == [16, 8]
+
+
+@pytest.mark.parametrize(
+    "n, invocations", [(10, [12]), (12, [12]), (13, [12, 1]), (30, [12, 12, 8])]
+)
+def test_max_batch_that_is_not_a_power_of_two(make_predictor, n, invocations):
+    result = make_predictor(12).predict(numbered_batch(n))
+
+    assert_rows_echoed(result, n)
+    assert EchoInterpreter.invocations == invocations
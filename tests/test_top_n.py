@@ -0,0 +1,38 @@
+import numpy as np
+
+from mushroom_core import top_n
+
+NAMES = ["amanita", "boletus", "chanterelle", "morel", "porcini"]
+
+
+def test_returns_the_n_best_classes_in_order():
+    probs = np.array([0.1, 0.4, 0.05, 0.3, 0.15], dtype=np.float32)
+
+    result = top_n(probs, NAMES, 3)
+
+    assert [name for name, _ in result] == ["boletus", "morel", "porcini"]
+    assert np.allclose([conf for _, conf in result], [0.4, 0.3, 0.15])
+    assert all(isinstance(conf, float) for _, conf in result)
+
+
+def test_matches_a_full_sort():
+    probs = np.random.default_rng(0).random(300).astype(np.float32)
+    names = [f"class_{i}" for i in range(300)]
+
+    expected = [names[i] for i in np.argsort(probs)[::-1][:20]]
+
+    assert [name for name, _ in top_n(probs, names, 20)] == expected
+
+
+def test_n_larger_than_class_count_returns_every_class():
+    probs = np.array([0.2, 0.1, 0.3, 0.25, 0.15], dtype=np.float32)
+
+    result = top_n(probs, NAMES, 10)
+
+    assert [name for name, _ in result] == [
+        "chanterelle",
+        "morel",
+        "amanita",
+        "porcini",
+        "boletus",
+    ]
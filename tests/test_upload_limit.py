@@ -0,0 +1,62 @@
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from mushroom_core import UploadLimitMiddleware
+
+MAX_BYTES = 1000
+
+
+def make_client():
+    app = FastAPI()
+    app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_BYTES)
+    app.state.parsed = 0
+
+    @app.post("/upload")
+    async def upload(image: UploadFile = File(...)):
+        app.state.parsed += 1
+        return {"size": len(await image.read())}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    return app, TestClient(app)
+
+
+def test_small_upload_reaches_the_handler():
+    app, client = make_client()
+
+    response = client.post("/upload", files={"image": ("a.jpg", b"x" * 100)})
+
+    assert response.status_code == 200
+    assert response.json() == {"size": 100}
+
+
+def test_oversized_upload_is_rejected_before_parsing():
+    app, client = make_client()
+
+    response = client.post("/upload", files={"image": ("a.jpg", b"x" * 2000)})
+
+    assert response.status_code == 413
+    assert "1000" in response.json()["detail"]
+    assert app.state.parsed == 0
+
+
+def test_body_without_content_length_is_rejected():
+    app, client = make_client()
+
+    def chunks():
+        yield b"x" * 10
+
+    response = client.post(
+        "/upload", content=chunks(), headers={"content-type": "image/jpeg"}
+    )
+
+    assert response.status_code == 411
+    assert app.state.parsed == 0
+
+
+def test_requests_without_a_body_are_not_limited():
+    _, client = make_client()
+
+    assert client.get("/health").status_code == 200
@@ -0,0 +1,56 @@
+import tempfile
+
+import pytest
+
+import backend
+
+
+@pytest.fixture
+def pinning(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(backend, "available_cpus", lambda: list(range(8)))
+    monkeypatch.setattr(backend, "WORKER_THREADS", 2)
+    monkeypatch.setattr(backend, "worker_lock", None)
+    pinned = []
+    monkeypatch.setattr(
+        backend.os, "sched_setaffinity", lambda pid, cpus: pinned.append(cpus)
+    )
+    held = []
+
+    def claim():
+        backend.pin_worker_cpus()
+        # Keep every claimed lock open, as each worker process would
+        held.append(backend.worker_lock)
+
+    yield claim, pinned
+    for lock in held:
+        if lock is not None:
+            lock.close()
+
+
+def test_claims_get_disjoint_slots(pinning):
+    claim, pinned = pinning
+
+    for _ in range(4):
+        claim()
+
+    assert pinned == [[0, 1], [2, 3], [4, 5], [6, 7]]
+
+
+def test_claims_beyond_the_slot_count_run_unpinned(pinning):
+    claim, pinned = pinning
+
+    for _ in range(5):
+        claim()
+
+    assert len(pinned) == 4
+
+
+def test_another_instance_does_not_take_this_instances_slots(pinning, monkeypatch):
+    claim, pinned = pinning
+
+    claim()
+    monkeypatch.setattr(backend, "PORT", backend.PORT + 1)
+    claim()
+
+    assert pinned == [[0, 1], [0, 1]]